@@ -1,66 +1,113 @@
 import pdfplumber
+import numpy as np
 import os
 from tqdm import tqdm
 import argparse
+import contextlib
+import functools
+import mmap
 import re
-import shutil
+import string
 from datetime import datetime
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # 定义输入输出文件夹
 INPUT_DIR = "input"
 OUTPUT_DIR = "output"
 
-# 定义标题关键词
+# 页数达到该值时才启用多进程，避免小文件承担进程启动开销
+PARALLEL_MIN_PAGES = 16
+# 每次分发给子进程的页数
+PAGE_CHUNKSIZE = 8
+# 输出文件的写缓冲区大小
+WRITE_BUFFER_SIZE = 1 << 20
+# 进度条最多刷新约 PROGRESS_STEPS 次，且两次刷新至少间隔 PROGRESS_MININTERVAL 秒
+PROGRESS_STEPS = 200
+PROGRESS_MININTERVAL = 0.5
+# 超过该大小的PDF文件使用内存映射读取
+MMAP_MIN_SIZE = 100 * 1024 * 1024
+
+# 定义标题关键词：(分组名, 匹配模式, 标题级别)
 CHAPTER_KEYWORDS = [
-    r'^第[一二三四五六七八九十]+章',
-    r'^[一二三四五六七八九十]+、',
-    r'^[0-9]+[.、]',
-    r'^[A-Z][.、]',
-    r'^[a-z][.、]',
-    r'^[①②③④⑤⑥⑦⑧⑨⑩]',
-    r'^[（(][一二三四五六七八九十][)）]',
-    r'^[（(][0-9]+[)）]'
+    ('chapter', r'^第[一二三四五六七八九十]+章', 1),
+    ('cn_num', r'^[一二三四五六七八九十]+、', 2),
+    ('digit', r'^[0-9]+[.、]', 2),
+    ('upper', r'^[A-Z][.、]', 3),
+    ('lower', r'^[a-z][.、]', 3),
+    ('circled', r'^[①②③④⑤⑥⑦⑧⑨⑩]', 3),
+    ('paren_cn', r'^[（(][一二三四五六七八九十][)）]', 4),
+    ('paren_digit', r'^[（(][0-9]+[)）]', 4)
 ]
 
+# 预编译正则表达式，避免每次调用时重复查找缓存
+# 所有标题关键词合并为一个带命名分组的正则，一次匹配即可确定命中的关键词
+_TITLE_ALT = re.compile('^(?:' + '|'.join(
+    f'(?P<{name}>{pattern[1:]})' for name, pattern, _ in CHAPTER_KEYWORDS
+) + ')')
+# 分组名到标题级别的映射，匹配后直接查表得到级别
+_TITLE_LEVELS = {name: level for name, _, level in CHAPTER_KEYWORDS}
+# 标题关键词可能的首字符，首字符不在其中的文本无需进行正则匹配
+_TITLE_FIRST_CHARS = frozenset("第一二三四五六七八九十0123456789（(①②③④⑤⑥⑦⑧⑨⑩" + string.ascii_letters)
+_RE_MULTI_BLANKLINE = re.compile(r'\n\s*\n\s*\n+')
+_RE_SENT_BREAK = re.compile(r'([。！？；])[ \t]*\n')
+# _RE_SENT_BREAK 匹配的句末标点
+_SENT_END_MARKS = '。！？；'
+
+# 常见OCR错误：将标点的半角/小写变体统一为标准全角标点
+_OCR_FIX_TABLE = str.maketrans({
+    '\ufe50': '，',  # ﹐ 小写逗号
+    '\uff64': '、',  # ､ 半角顿号
+    '\uff61': '。',  # ｡ 半角句号
+    '\ufe52': '。',  # ﹒ 小写句号
+    '\ufe55': '：',  # ﹕ 小写冒号
+    '\ufe54': '；',  # ﹔ 小写分号
+})
+
 def ensure_directories():
     """确保必要的目录存在"""
     os.makedirs(INPUT_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+@functools.lru_cache(maxsize=64)
+def _classify_font(font_name):
+    """根据字体名判断粗体、斜体，同一字体名只计算一次"""
+    font_name = font_name.lower()
+    return (
+        font_name,
+        'bold' in font_name or 'black' in font_name,
+        'italic' in font_name or 'oblique' in font_name
+    )
+
 def get_font_info(text_obj):
     """获取文本的字体信息"""
     if not text_obj:
         return None
-    font_name = text_obj.get('fontname', '').lower()
-    font_size = text_obj.get('size', 0)
+    font_name, is_bold, is_italic = _classify_font(text_obj.get('fontname', ''))
     return {
         'name': font_name,
-        'size': font_size,
-        'is_bold': 'bold' in font_name or 'black' in font_name,
-        'is_italic': 'italic' in font_name or 'oblique' in font_name
+        'size': text_obj.get('size', 0),
+        'is_bold': is_bold,
+        'is_italic': is_italic
     }
 
-def analyze_page_font_sizes(page):
+def analyze_page_font_sizes(words):
     """分析页面中的字体大小分布"""
-    font_sizes = []
-    for obj in page.extract_words(keep_blank_chars=True, x_tolerance=3, y_tolerance=3):
-        font_info = get_font_info(obj)
-        if font_info and font_info['size'] > 0:
-            font_sizes.append(font_info['size'])
+    font_sizes = np.fromiter((obj['size'] for obj in words if obj.get('size', 0) > 0),
+                             dtype=np.float64)
     
-    if not font_sizes:
+    if not font_sizes.size:
         return None
     
-    # 计算字体大小的分布
-    font_sizes.sort()
-    total = len(font_sizes)
+    # 计算字体大小的分布，只做部分排序即可取得指定位置的值
+    total = font_sizes.size
+    indices = [int(total * 0.95), int(total * 0.85), int(total * 0.75)]
+    font_sizes = np.partition(font_sizes, indices)
     
     # 使用百分位数来划分字体大小等级
     percentiles = {
-        'h4': font_sizes[int(total * 0.95)],  # 最大的5%作为h4
-        'h5': font_sizes[int(total * 0.85)],  # 接下来的10%作为h5
-        'h6': font_sizes[int(total * 0.75)]   # 接下来的10%作为h6
+        'h4': float(font_sizes[indices[0]]),  # 最大的5%作为h4
+        'h5': float(font_sizes[indices[1]]),  # 接下来的10%作为h5
+        'h6': float(font_sizes[indices[2]])   # 接下来的10%作为h6
     }
     
     return percentiles
@@ -72,26 +119,11 @@ def is_semantic_title(text):
     
     text = text.strip()
     
-    # 检查是否匹配标题关键词
-    for pattern in CHAPTER_KEYWORDS:
-        if re.match(pattern, text):
-            # 根据不同的模式确定标题级别
-            if re.match(r'^第[一二三四五六七八九十]+章', text):
-                return True, 1
-            elif re.match(r'^[一二三四五六七八九十]+、', text):
-                return True, 2
-            elif re.match(r'^[0-9]+[.、]', text):
-                return True, 2
-            elif re.match(r'^[A-Z][.、]', text):
-                return True, 3
-            elif re.match(r'^[a-z][.、]', text):
-                return True, 3
-            elif re.match(r'^[①②③④⑤⑥⑦⑧⑨⑩]', text):
-                return True, 3
-            elif re.match(r'^[（(][一二三四五六七八九十][)）]', text):
-                return True, 4
-            elif re.match(r'^[（(][0-9]+[)）]', text):
-                return True, 4
+    # 检查是否匹配标题关键词，匹配到的模式直接给出标题级别
+    if text and text[0] in _TITLE_FIRST_CHARS:
+        match = _TITLE_ALT.match(text)
+        if match:
+            return True, _TITLE_LEVELS[match.lastgroup]
     
     # 检查其他标题特征
     if len(text) < 50 and text.endswith('：'):
@@ -125,43 +157,54 @@ def clean_text(text):
     if not text:
         return ""
     
-    # 移除多余的空白字符，但保留段落结构
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+    # 移除多余的空白字符，但保留段落结构（至少有三个换行符时才可能匹配）
+    if text.count('\n') >= 3:
+        text = _RE_MULTI_BLANKLINE.sub('\n\n', text)
     
     # 修复常见的OCR错误
-    text = text.replace('，', '，').replace('。', '。')
-    text = text.replace('：', '：').replace('；', '；')
+    text = text.translate(_OCR_FIX_TABLE)
     
-    # 修复常见的断行问题
-    text = re.sub(r'([。！？；])[ \t]*\n', r'\1\n\n', text)
+    # 修复常见的断行问题（需要同时包含换行符和句末标点）
+    if '\n' in text and any(mark in text for mark in _SENT_END_MARKS):
+        text = _RE_SENT_BREAK.sub(r'\1\n\n', text)
     
     return text.strip()
 
-def format_text_with_style(text, font_info):
+def format_text_with_style(text, is_bold, is_italic):
     """根据字体信息格式化文本"""
     if not text:
         return text
     
     # 处理加粗
-    if font_info and font_info['is_bold']:
+    if is_bold:
         text = f"**{text}**"
     
     # 处理斜体
-    if font_info and font_info['is_italic']:
+    if is_italic:
         text = f"*{text}*"
     
     return text
 
 def process_text_objects(page):
-    """处理页面中的文本对象，保持原始格式"""
-    text_objects = []
+    """处理页面中的文本对象，保持原始格式
+    
+    返回按列存储的文本对象 (levels, texts, bold_flags, italic_flags)，
+    levels 中 0 表示段落，1-6 表示标题级别。
+    """
+    levels = []
+    texts = []
+    bold_flags = []
+    italic_flags = []
     current_paragraph = []
     current_font = None
     
+    # 页面文字只提取一次，字体分析与正文处理共用
+    words = page.extract_words(keep_blank_chars=True, x_tolerance=3, y_tolerance=3)
+    
     # 分析页面字体大小分布
-    font_percentiles = analyze_page_font_sizes(page)
+    font_percentiles = analyze_page_font_sizes(words)
     
-    for obj in page.extract_words(keep_blank_chars=True, x_tolerance=3, y_tolerance=3):
+    for obj in words:
         text = obj['text']
         font_info = get_font_info(obj)
         
@@ -171,19 +214,17 @@ def process_text_objects(page):
         if title_level > 0:
             # 处理之前的段落
             if current_paragraph:
-                text_objects.append({
-                    'type': 'paragraph',
-                    'text': ' '.join(current_paragraph),
-                    'font_info': current_font
-                })
+                levels.append(0)
+                texts.append(' '.join(current_paragraph))
+                bold_flags.append(current_font['is_bold'])
+                italic_flags.append(current_font['is_italic'])
                 current_paragraph = []
             
             # 添加标题
-            text_objects.append({
-                'type': f'h{title_level}',
-                'text': text,
-                'font_info': font_info
-            })
+            levels.append(title_level)
+            texts.append(text)
+            bold_flags.append(font_info['is_bold'])
+            italic_flags.append(font_info['is_italic'])
         else:
             # 处理普通文本
             if not current_paragraph:
@@ -192,30 +233,27 @@ def process_text_objects(page):
     
     # 处理最后一个段落
     if current_paragraph:
-        text_objects.append({
-            'type': 'paragraph',
-            'text': ' '.join(current_paragraph),
-            'font_info': current_font
-        })
+        levels.append(0)
+        texts.append(' '.join(current_paragraph))
+        bold_flags.append(current_font['is_bold'])
+        italic_flags.append(current_font['is_italic'])
     
-    return text_objects
+    return levels, texts, bold_flags, italic_flags
 
 def convert_to_markdown(text_objects):
     """将处理后的文本对象转换为Markdown格式"""
+    levels, texts, bold_flags, italic_flags = text_objects
     markdown_lines = []
     
-    for obj in text_objects:
-        text = obj['text']
-        obj_type = obj['type']
-        font_info = obj['font_info']
+    for i in range(len(levels)):
+        level = levels[i]
         
-        if obj_type.startswith('h'):
+        if level:
             # 处理标题
-            level = int(obj_type[1])
-            markdown_lines.append(f"{'#' * level} {text}\n")
-        elif obj_type == 'paragraph':
+            markdown_lines.append(f"{'#' * level} {texts[i]}\n")
+        else:
             # 处理段落
-            formatted_text = format_text_with_style(text, font_info)
+            formatted_text = format_text_with_style(texts[i], bold_flags[i], italic_flags[i])
             markdown_lines.append(f"{formatted_text}\n\n")
     
     return ''.join(markdown_lines)
@@ -226,27 +264,25 @@ def extract_tables(page):
     if not tables:
         return ""
     
-    markdown_tables = []
+    # 所有表格的行汇总到同一个列表，最后一次性拼接
+    lines = []
     for table in tables:
         if not table or not table[0]:
             continue
-            
-        # 创建表头
-        header = '| ' + ' | '.join(str(cell) if cell else '' for cell in table[0]) + ' |'
-        separator = '| ' + ' | '.join(['---'] * len(table[0])) + ' |'
         
-        # 创建表格内容
-        rows = []
-        for row in table[1:]:
-            if not row:
-                continue
-            rows.append('| ' + ' | '.join(str(cell) if cell else '' for cell in row) + ' |')
+        # 表格之间空一行
+        if lines:
+            lines.append('')
+        
+        # 创建表头，单元格为 None 时输出空字符串
+        lines.append('| ' + ' | '.join([cell or '' for cell in table[0]]) + ' |')
+        lines.append('| ' + ' | '.join(['---'] * len(table[0])) + ' |')
         
-        # 组合表格
-        markdown_table = '\n'.join([header, separator] + rows)
-        markdown_tables.append(markdown_table)
+        # 创建表格内容
+        lines.extend(['| ' + ' | '.join([cell or '' for cell in row]) + ' |'
+                      for row in table[1:] if row])
     
-    return '\n\n'.join(markdown_tables)
+    return '\n'.join(lines)
 
 def get_output_path(pdf_path):
     """生成输出文件路径"""
@@ -254,58 +290,139 @@ def get_output_path(pdf_path):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     return os.path.join(OUTPUT_DIR, f"{base_name}_{timestamp}.md")
 
-def convert_pdf_to_md(pdf_path, output_path=None):
-    """将PDF文件转换为Markdown格式"""
+@contextlib.contextmanager
+def open_pdf(pdf_path):
+    """打开PDF文件，大文件使用内存映射以减少小块读取的系统调用"""
+    if os.path.getsize(pdf_path) < MMAP_MIN_SIZE:
+        with pdfplumber.open(pdf_path) as pdf:
+            yield pdf
+        return
+    
+    with open(pdf_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with pdfplumber.open(mm) as pdf:
+            yield pdf
+
+def process_page(page):
+    """处理单个页面，返回页面的Markdown文本和表格"""
+    # 没有文字的页面（如纯图片扫描页）直接跳过
+    if not page.chars:
+        return "", ""
+    
+    # 处理文本对象
+    text_objects = process_text_objects(page)
+    markdown_text = convert_to_markdown(text_objects)
+    
+    # 提取表格，页面上没有线条时不可能存在表格
+    if page.lines or page.rects or page.curves:
+        tables = extract_tables(page)
+    else:
+        tables = ""
+    
+    return markdown_text, tables
+
+def release_page(page):
+    """释放页面缓存的解析对象，避免处理大文件时内存持续增长"""
+    page.flush_cache()
+    page.get_textmap.cache_clear()
+
+def process_and_release_page(page):
+    """处理单个页面，处理完成后立即释放页面缓存"""
+    try:
+        return process_page(page)
+    finally:
+        release_page(page)
+
+# 子进程中打开的PDF对象，由 _init_worker 初始化，随子进程退出释放
+_worker_pdf = None
+_worker_stack = contextlib.ExitStack()
+
+def _init_worker(pdf_path):
+    """子进程初始化，每个进程只打开一次PDF文件"""
+    global _worker_pdf
+    _worker_pdf = _worker_stack.enter_context(open_pdf(pdf_path))
+
+def _process_page_in_worker(page_num):
+    """在子进程中处理指定页"""
+    return process_and_release_page(_worker_pdf.pages[page_num])
+
+def iter_page_results(pdf, pdf_path, workers):
+    """按页码顺序返回每一页的处理结果"""
+    total_pages = len(pdf.pages)
+    
+    if workers <= 1 or total_pages < PARALLEL_MIN_PAGES:
+        for page_num in range(total_pages):
+            yield process_and_release_page(pdf.pages[page_num])
+        return
+    
+    # 多进程处理，executor.map 保证结果按页码顺序返回
+    # 进程数不超过分块数，避免多余进程各自打开并解析整个PDF
+    max_workers = min(workers, -(-total_pages // PAGE_CHUNKSIZE))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(pdf_path,)) as executor:
+        yield from executor.map(_process_page_in_worker, range(total_pages),
+                                chunksize=PAGE_CHUNKSIZE)
+
+def convert_pdf_to_md(pdf_path, output_path=None, workers=None, verbose=True):
+    """将PDF文件转换为Markdown格式，返回输出文件路径
+    
+    verbose 为 False 时不打印转换信息和进度条，供批量并行转换的子进程使用。
+    """
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"PDF文件不存在: {pdf_path}")
     
     if output_path is None:
         output_path = get_output_path(pdf_path)
     
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with open_pdf(pdf_path) as pdf:
             total_pages = len(pdf.pages)
-            print(f"开始转换PDF文件: {pdf_path}")
-            print(f"总页数: {total_pages}")
+            if verbose:
+                print(f"开始转换PDF文件: {pdf_path}")
+                print(f"总页数: {total_pages}")
             
-            with open(output_path, 'w', encoding='utf-8') as md_file:
+            with open(output_path, 'wb', buffering=WRITE_BUFFER_SIZE) as md_file:
                 # 写入标题
                 title = os.path.splitext(os.path.basename(pdf_path))[0]
-                md_file.write(f"# {title}\n\n")
+                md_file.write(f"# {title}\n\n".encode('utf-8'))
                 
                 # 处理每一页
-                for page_num in tqdm(range(total_pages), desc="转换进度"):
-                    page = pdf.pages[page_num]
-                    
-                    # 处理文本对象
-                    text_objects = process_text_objects(page)
-                    markdown_text = convert_to_markdown(text_objects)
-                    
-                    # 提取表格
-                    tables = extract_tables(page)
-                    
+                page_results = iter_page_results(pdf, pdf_path, workers)
+                for page_num, (markdown_text, tables) in enumerate(
+                        tqdm(page_results, total=total_pages, desc="转换进度",
+                             mininterval=PROGRESS_MININTERVAL,
+                             miniters=max(1, total_pages // PROGRESS_STEPS),
+                             disable=not verbose)):
                     if markdown_text or tables:
-                        # 写入页码
-                        md_file.write(f"## 第 {page_num + 1} 页\n\n")
+                        # 页面内容先汇总，再一次性编码写入
+                        parts = [f"## 第 {page_num + 1} 页\n\n"]
                         
-                        # 写入处理后的文本
+                        # 处理后的文本
                         if markdown_text:
-                            md_file.write(markdown_text)
+                            parts.append(markdown_text)
                         
-                        # 写入表格
+                        # 表格
                         if tables:
-                            md_file.write(tables + "\n\n")
+                            parts.append(tables)
+                            parts.append("\n\n")
                         
-                        # 添加页面分隔符
-                        md_file.write("---\n\n")
+                        # 页面分隔符
+                        parts.append("---\n\n")
+                        md_file.write(''.join(parts).encode('utf-8'))
             
-            print(f"\n转换完成！输出文件保存在: {output_path}")
+            if verbose:
+                print(f"\n转换完成！输出文件保存在: {output_path}")
             
     except Exception as e:
-        print(f"转换过程中出现错误: {str(e)}")
+        if verbose:
+            print(f"转换过程中出现错误: {str(e)}")
         raise
+    
+    return output_path
 
-def process_input_directory():
+def process_input_directory(workers=None):
     """处理input目录中的所有PDF文件"""
     ensure_directories()
     
@@ -317,26 +434,47 @@ def process_input_directory():
     
     print(f"找到 {len(pdf_files)} 个PDF文件")
     
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(INPUT_DIR, pdf_file)
-        try:
-            convert_pdf_to_md(pdf_path)
-        except Exception as e:
-            print(f"处理文件 {pdf_file} 时出错: {str(e)}")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    if workers <= 1 or len(pdf_files) == 1:
+        for pdf_file in pdf_files:
+            pdf_path = os.path.join(INPUT_DIR, pdf_file)
+            try:
+                convert_pdf_to_md(pdf_path, workers=workers)
+            except Exception as e:
+                print(f"处理文件 {pdf_file} 时出错: {str(e)}")
+        return
+    
+    # 多个文件时按文件并行，每个文件在各自进程内逐页处理
+    # 子进程不输出信息，由主进程统一显示按文件计数的进度条
+    with ProcessPoolExecutor(max_workers=min(workers, len(pdf_files))) as executor:
+        futures = {
+            executor.submit(convert_pdf_to_md, os.path.join(INPUT_DIR, pdf_file), None, 1, False): pdf_file
+            for pdf_file in pdf_files
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="转换进度"):
+            try:
+                output_path = future.result()
+                tqdm.write(f"转换完成！{futures[future]} 输出文件保存在: {output_path}")
+            except Exception as e:
+                tqdm.write(f"处理文件 {futures[future]} 时出错: {str(e)}")
 
 def main():
     parser = argparse.ArgumentParser(description='将PDF文件转换为Markdown格式')
     parser.add_argument('--file', help='单个PDF文件路径（可选）')
     parser.add_argument('-o', '--output', help='输出文件路径（可选）')
     parser.add_argument('--batch', action='store_true', help='处理input目录中的所有PDF文件')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='并行进程数（可选，默认为CPU核心数，设为1则不使用多进程）')
     
     args = parser.parse_args()
     
     try:
         if args.batch:
-            process_input_directory()
+            process_input_directory(args.workers)
         elif args.file:
-            convert_pdf_to_md(args.file, args.output)
+            convert_pdf_to_md(args.file, args.output, args.workers)
         else:
             print("请指定要转换的PDF文件或使用 --batch 处理input目录中的所有文件")
             return 1